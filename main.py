@@ -1,12 +1,55 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
-import base64, io, pdfplumber, re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import repeat
+import asyncio, base64, hashlib, json, multiprocessing, os, threading, time
+import numpy as np
+import orjson
+import re2
+import redis.asyncio as redis
 
 # ---------------- BASIC CONFIG ----------------
-app = FastAPI(title="7Lines Engineering AI – Dubai Building Code Compliance Checker")
-client = OpenAI()  # requires OPENAI_API_KEY in environment variable
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson (fastapi.responses.ORJSONResponse is deprecated)."""
+    def render(self, content):
+        return orjson.dumps(content)
+
+app = FastAPI(
+    title="7Lines Engineering AI – Dubai Building Code Compliance Checker",
+    default_response_class=ORJSONResponse,
+)
+
+# openai and pypdfium2 are imported where first used: openai alone takes about
+# half a second to import, and PDF worker processes never need it.
+@lru_cache(maxsize=None)
+def _get_client():
+    """One shared client (and HTTP connection pool) for /analyze and /chat."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(timeout=60.0, max_retries=2)  # requires OPENAI_API_KEY in environment variable
+
+def _response_text(response):
+    """Return the text of a completed, non-empty GPT response; raise otherwise.
+
+    An "incomplete" response (e.g. reasoning used up the output budget) does not
+    raise in the SDK, so this keeps empty or truncated text out of the caches.
+    """
+    if response.status == "incomplete":
+        details = response.incomplete_details
+        raise RuntimeError(f"response incomplete ({details.reason if details else 'unknown reason'})")
+    if response.status != "completed":
+        raise RuntimeError(f"response {response.status}")
+    if not response.output_text:
+        raise RuntimeError("the response was empty")
+    return response.output_text
+
+DBC_URL = (
+    "https://dm.gov.ae/wp-content/uploads/2021/12/"
+    "Dubai%20Building%20Code_English_2021%20Edition_compressed.pdf"
+)
 
 # Allow frontend (like Wix) to connect
 app.add_middleware(
@@ -17,10 +60,203 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------------- PERMIT CHECKLIST ----------------
+# Simulated Permit Checklist Rules (based on your Permit Checklist).
+# Patterns are lowercase and matched case-insensitively.
+CHECKLIST = [
+    ("E6", "door width ≥ 900mm", r"door.*(900|1\.0|1000)"),
+    ("LCR2", "ramp slope ≤ 8%", r"ramp.*(1[:/]\s*12|8\s*%)"),
+    ("PE1", "path width ≥ 1800mm", r"path.*(1800|1\.8)"),
+    ("SPpt", "accessible toilet available", r"toilet|wc|accessible"),
+    ("PA1", "parking within 50m", r"parking.*(50|fifty)"),
+    ("GD3", "handrail height ≥ 900mm", r"handrail.*(900|1\.0|1000)"),
+    ("GS", "stair width ≥ 1200mm", r"stair.*(1200|1\.2)"),
+    ("PE7", "no abrupt level changes", r"level.*change"),
+    ("SPsh", "shower turning radius ≥1500mm", r"shower.*(1500|1\.5)"),
+    ("LCH1", "guardrail height ≥1100mm", r"guardrail.*(1100|1\.1)"),
+]
+
+# All rules compiled into one RE2 set: a single linear-time DFA pass over the
+# text reports every rule that matches, and ".*" can never backtrack. RE2 folds
+# case itself, so the text is scanned as-is without a lowercased copy.
+_CHECKLIST_OPTIONS = re2.Options()
+_CHECKLIST_OPTIONS.case_sensitive = False
+_CHECKLIST_SET = re2.Set.SearchSet(_CHECKLIST_OPTIONS)
+for _, _, pattern in CHECKLIST:
+    _CHECKLIST_SET.Add(pattern)
+_CHECKLIST_SET.Compile()
+
+def _run_checks(pdf_text):
+    """Return the checklist rules the PDF text does not satisfy."""
+    # Bit i is set when rule i matched somewhere in the single pass over the text
+    mask = 0
+    for i in _CHECKLIST_SET.Match(pdf_text) or ():
+        mask |= 1 << i
+    return [
+        {"code": code, "description": f"Missing or non-compliant: {criteria}"}
+        for i, (code, criteria, _) in enumerate(CHECKLIST)
+        if not mask & (1 << i)
+    ]
+
+# ---------------- PDF EXTRACTION ----------------
+MAX_PAGES = 8  # Read up to 8 pages
+POOL_WORKERS = min(os.cpu_count() or 1, MAX_PAGES)
+INLINE_PAGES = 2  # documents this short skip the worker pool round-trip
+
+# PDFium is not thread-safe, even across separate documents, so in this
+# process it only runs under _PDFIUM_LOCK; longer documents are extracted in
+# parallel worker processes.
+_PDFIUM_LOCK = threading.Lock()
+
+# Workers must not be forked from this process: the pool grows from
+# to_thread threads while other threads may hold PDFium (or any other lock)
+# mid-call, and a forked child inherits that state with no thread to release
+# it. forkserver children start from a clean single-threaded server instead.
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+def _new_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT)
+
+_POOL = _new_pool(POOL_WORKERS)
+_POOL_LOCK = threading.Lock()
+
+def _pool_map(fn, *iterables):
+    """Executor.map on the worker pool, replacing the pool if a worker died."""
+    global _POOL
+    pool = _POOL
+    try:
+        return list(pool.map(fn, *iterables))
+    except BrokenProcessPool:
+        # A worker was killed (PDFium crash, OOM), failing every call in flight
+        # on the pool: swap in a fresh pool so later requests are unaffected.
+        with _POOL_LOCK:
+            if _POOL is pool:
+                pool.shutdown(wait=False)
+                _POOL = _new_pool(POOL_WORKERS)
+    # Retry this document once in a private worker, so a PDF that crashes
+    # PDFium again only fails its own request, not others on the shared pool.
+    with _new_pool(1) as private:
+        return list(private.map(fn, *iterables))
+
+def _open_pdf(pdf_bytes):
+    import pypdfium2 as pdfium
+    return pdfium.PdfDocument(pdf_bytes)
+
+def _page_text(pdf, start, stop):
+    """Extract pages [start, stop) from an open document."""
+    return "".join(pdf[i].get_textpage().get_text_range() for i in range(start, stop))
+
+def _extract_pages(pdf_bytes, start, stop):
+    """Extract a page range, opening the document once (runs in a worker process)."""
+    with _open_pdf(pdf_bytes) as pdf:
+        return _page_text(pdf, start, stop)
+
+def _extract_text(pdf_bytes):
+    """Extract the text of the first MAX_PAGES pages, in page order."""
+    with _PDFIUM_LOCK, _open_pdf(pdf_bytes) as pdf:
+        page_count = min(len(pdf), MAX_PAGES)
+        if page_count <= INLINE_PAGES:
+            return _page_text(pdf, 0, page_count)
+
+    # One contiguous range per worker, so each worker parses the document once
+    step = -(-page_count // POOL_WORKERS)
+    starts = range(0, page_count, step)
+    stops = [min(start + step, page_count) for start in starts]
+    return "".join(_pool_map(_extract_pages, repeat(pdf_bytes), starts, stops))
+
+# ---------------- RESPONSE CACHES ----------------
+EXACT_CACHE_SIZE = 1024
+SHARED_CACHE_TTL = 24 * 3600  # seconds
+
+# Exact-match LRU caches keyed on a sha256 hex digest: identical questions and
+# re-uploads of the same PDF are answered without any model or parsing work.
+# When REDIS_URL is set, Redis is a second tier shared by every worker process.
+_chat_exact = OrderedDict()  # sha256(prompt) -> reply
+_analysis_cache = OrderedDict()  # sha256(pdf_bytes) -> (summary excerpt, failed checks)
+_summary_cache = OrderedDict()  # sha256(pdf_bytes) -> GPT summary
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _cache_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > EXACT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+_redis = None
+if os.environ.get("REDIS_URL"):
+    # Short timeout: a slow cache must never hold up a request
+    _redis = redis.Redis.from_url(os.environ["REDIS_URL"], socket_timeout=1.0)
+
+async def _lookup(cache, prefix, key):
+    """Look a key up in the in-process cache, then in Redis. Redis errors count as misses."""
+    value = _cache_get(cache, key)
+    if value is None and _redis is not None:
+        try:
+            raw = await _redis.get(f"{prefix}:{key}")
+        except redis.RedisError:
+            raw = None
+        if raw is not None:
+            value = json.loads(raw)
+            _cache_put(cache, key, value)
+    return value
+
+async def _store(cache, prefix, key, value):
+    _cache_put(cache, key, value)
+    if _redis is not None:
+        try:
+            await _redis.setex(f"{prefix}:{key}", SHARED_CACHE_TTL, json.dumps(value))
+        except redis.RedisError:
+            pass
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+CHAT_CACHE_SIZE = 1024
+CHAT_CACHE_TTL = 24 * 3600  # seconds
+CHAT_CACHE_THRESHOLD = 0.92  # cosine similarity needed to reuse a reply
+
+# Ring buffer of normalized question embeddings and their replies, so a
+# paraphrase of a recent question is answered without another GPT call.
+_chat_vectors = np.zeros((CHAT_CACHE_SIZE, EMBEDDING_DIM), dtype=np.float32)
+_chat_expires = np.zeros(CHAT_CACHE_SIZE)  # 0 marks an empty slot
+_chat_replies = [None] * CHAT_CACHE_SIZE
+_chat_next = 0
+
+async def _embed(text):
+    """Return the normalized embedding of a chat message."""
+    result = await _get_client().embeddings.create(model=EMBEDDING_MODEL, input=text)
+    vector = np.asarray(result.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def _cached_reply(vector):
+    """Return the reply to the most similar live cached question, if close enough."""
+    sims = np.where(_chat_expires > time.time(), _chat_vectors @ vector, -1.0)
+    best = int(sims.argmax())
+    if sims[best] >= CHAT_CACHE_THRESHOLD:
+        return _chat_replies[best]
+    return None
+
+def _cache_reply(vector, reply):
+    """Store a reply, overwriting the oldest slot once the cache is full."""
+    global _chat_next
+    slot = _chat_next
+    _chat_vectors[slot] = vector
+    _chat_expires[slot] = time.time() + CHAT_CACHE_TTL
+    _chat_replies[slot] = reply
+    _chat_next = (slot + 1) % CHAT_CACHE_SIZE
+
 # ---------------- HOME PAGE ----------------
-@app.get("/", response_class=HTMLResponse)
-def home():
-    return """
+# Static page, encoded once at import instead of on every request.
+_HOME_HTML = """
     <html>
       <head>
         <title>7Lines Engineering AI</title>
@@ -60,6 +296,11 @@ def home():
           <p><b>POST</b> /analyze</p>
           <p>Uploads a PDF plan and checks it against the Dubai Building Code 2021 and Permit Checklist.</p>
         </div>
+        <div class="endpoint">
+          <h3>🗂️ Batch Analysis</h3>
+          <p><b>POST</b> /analyze_batch</p>
+          <p>Checks up to 20 PDF plans in a single request.</p>
+        </div>
         <div class="endpoint">
           <h3>💬 AI Chat Assistant</h3>
           <p><b>POST</b> /chat</p>
@@ -70,83 +311,219 @@ def home():
         </a>
       </body>
     </html>
-    """
+    """.encode("utf-8")
+
+@app.get("/", response_class=HTMLResponse)
+def home():
+    return HTMLResponse(_HOME_HTML, headers={"Cache-Control": "public, max-age=3600"})
 
 # ---------------- /analyze ----------------
+SUMMARY_CHARS = 6000  # plan text sent to GPT
+
+def _parse_pdf(pdf_bytes):
+    """Extract the PDF text once and return (summary excerpt, failed checks)."""
+    pdf_text = _extract_text(pdf_bytes)
+    # Collapse whitespace runs (layout padding, line breaks) so the excerpt
+    # carries more plan text per prompt token.
+    excerpt = " ".join(pdf_text.split())[:SUMMARY_CHARS]
+    return excerpt, _run_checks(pdf_text)
+
+SUMMARY_PROMPT = """
+    You are an AI Building Compliance Engineer using the Dubai Building Code 2021 ({dbc_url}).
+    Summarize the compliance of the building plan below, citing code sections when possible.
+    Permit Checklist items flagged as missing or non-compliant: {flagged}.
+    Plan text:
+    {excerpt}
+    """
+
+# Shared-cache keys carry a fingerprint of everything an analysis depends on
+# besides the PDF itself, so a deploy that changes the rules or the prompt
+# stops reading results computed by the previous version.
+_ANALYSIS_VERSION = _sha256(repr((CHECKLIST, MAX_PAGES, SUMMARY_CHARS, SUMMARY_PROMPT, DBC_URL)).encode())[:12]
+
+def _summary_prompt(excerpt, failed_checks):
+    flagged = ", ".join(check["code"] for check in failed_checks) or "none"
+    return SUMMARY_PROMPT.format(dbc_url=DBC_URL, flagged=flagged, excerpt=excerpt)
+
+async def _analyze_pdf(pdf_bytes):
+    """Run the checklist and GPT summary for one decoded PDF, reusing cached work."""
+    pdf_hash = _sha256(pdf_bytes)
+    parsed = await _lookup(_analysis_cache, f"analysis:{_ANALYSIS_VERSION}", pdf_hash)
+    if parsed is None:
+        # Parsing and matching are blocking, so keep them off the event loop
+        parsed = await asyncio.to_thread(_parse_pdf, pdf_bytes)
+        await _store(_analysis_cache, f"analysis:{_ANALYSIS_VERSION}", pdf_hash, parsed)
+    excerpt, failed_checks = parsed
+
+    total = len(CHECKLIST)
+    passed = total - len(failed_checks)
+    pass_rate = int((passed / total) * 100)
+
+    summary = await _lookup(_summary_cache, f"summary:{_ANALYSIS_VERSION}", pdf_hash)
+    if summary is None:
+        try:
+            response = await _get_client().responses.create(model="gpt-5", input=_summary_prompt(excerpt, failed_checks))
+            summary = _response_text(response)
+            await _store(_summary_cache, f"summary:{_ANALYSIS_VERSION}", pdf_hash, summary)
+        except Exception as e:
+            summary = f"⚠️ AI could not summarize this plan: {e}"
+
+    return {
+        "status": "ok",
+        "pass_rate": pass_rate,
+        "failed": failed_checks,
+        "summary": summary
+    }
+
+def _is_multipart(request):
+    return request.headers.get("content-type", "").startswith("multipart/form-data")
+
+async def _read_pdf(source):
+    """Return the PDF bytes of a multipart upload or of a base64 string (Wix)."""
+    if isinstance(source, str):
+        return base64.b64decode(source)
+    return await source.read()
+
 @app.post("/analyze")
 async def analyze(request: Request):
-    """Analyze uploaded PDF (base64) and evaluate compliance with the Permit Checklist."""
+    """Analyze an uploaded PDF, evaluate it against the Permit Checklist and summarize it with GPT.
+
+    Accepts a multipart upload in the "file" field, or JSON {"file_data": <base64>}.
+    """
+    try:
+        if _is_multipart(request):
+            source = (await request.form()).get("file")
+        else:
+            source = (await request.json()).get("file_data")
+        if not source:
+            return {"status": "error", "message": "No file data received."}
+
+        pdf_bytes = await _read_pdf(source)
+        return await _analyze_pdf(pdf_bytes)
+
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# ---------------- /analyze_batch ----------------
+MAX_BATCH_FILES = 20
+
+async def _analyze_file(source):
+    try:
+        return await _analyze_pdf(await _read_pdf(source))
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/analyze_batch")
+async def analyze_batch(request: Request):
+    """Analyze several uploaded PDFs in one call.
+
+    Accepts multipart uploads in repeated "files" fields, or JSON {"files": [<base64>, ...]}.
+
+    All pages of all files share the extraction worker pool; results come back
+    in upload order, each shaped like an /analyze response.
+    """
     try:
-        data = await request.json()
-        file_data = data.get("file_data")
-        if not file_data:
+        if _is_multipart(request):
+            files = (await request.form()).getlist("files")
+        else:
+            files = (await request.json()).get("files") or []
+        if not files:
             return {"status": "error", "message": "No file data received."}
+        if len(files) > MAX_BATCH_FILES:
+            return {"status": "error", "message": f"At most {MAX_BATCH_FILES} files per batch."}
 
-        # Decode Base64 and read PDF
-        pdf_bytes = base64.b64decode(file_data)
-        pdf_text = ""
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages[:8]:  # Read up to 8 pages
-                pdf_text += page.extract_text() or ""
-
-        pdf_text = pdf_text.lower()
-
-        # Simulated Permit Checklist Rules (based on your Permit Checklist)
-        checklist = [
-            {"code": "E6", "criteria": "door width ≥ 900mm", "regex": r"door.*(900|1\.0|1000)"},
-            {"code": "LCR2", "criteria": "ramp slope ≤ 8%", "regex": r"ramp.*(1[:/]\s*12|8\s*%)"},
-            {"code": "PE1", "criteria": "path width ≥ 1800mm", "regex": r"path.*(1800|1\.8)"},
-            {"code": "SPpt", "criteria": "accessible toilet available", "regex": r"toilet|wc|accessible"},
-            {"code": "PA1", "criteria": "parking within 50m", "regex": r"parking.*(50|fifty)"},
-            {"code": "GD3", "criteria": "handrail height ≥ 900mm", "regex": r"handrail.*(900|1\.0|1000)"},
-            {"code": "GS", "criteria": "stair width ≥ 1200mm", "regex": r"stair.*(1200|1\.2)"},
-            {"code": "PE7", "criteria": "no abrupt level changes", "regex": r"level.*change"},
-            {"code": "SPsh", "criteria": "shower turning radius ≥1500mm", "regex": r"shower.*(1500|1\.5)"},
-            {"code": "LCH1", "criteria": "guardrail height ≥1100mm", "regex": r"guardrail.*(1100|1\.1)"}
-        ]
-
-        failed_checks = []
-        passed = 0
-        for rule in checklist:
-            if re.search(rule["regex"], pdf_text):
-                passed += 1
-            else:
-                failed_checks.append({"code": rule["code"], "description": f"Missing or non-compliant: {rule['criteria']}"})
-
-        total = len(checklist)
-        pass_rate = int((passed / total) * 100)
-
-        return {
-            "status": "ok",
-            "pass_rate": pass_rate,
-            "failed": failed_checks
-        }
+        results = await asyncio.gather(*(_analyze_file(source) for source in files))
+        return {"status": "ok", "results": results}
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 # ---------------- /chat ----------------
+def _sse(text, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(text)}\n\n"
+
+def _stream_error(event):
+    """Describe a failed, incomplete or error event from a Responses stream."""
+    if event.type == "error":
+        return event.message
+    if event.type == "response.failed":
+        error = event.response.error
+        return error.message if error else "response failed"
+    details = event.response.incomplete_details
+    return f"response incomplete ({details.reason if details else 'unknown reason'})"
+
+async def _stream_reply(events, prompt_hash, vector):
+    """Relay GPT text deltas as server-sent events; cache the reply only once it completed."""
+    parts = []
+    completed = False
+    try:
+        async with events:
+            async for event in events:
+                if event.type == "response.output_text.delta":
+                    parts.append(event.delta)
+                    yield _sse(event.delta)
+                elif event.type == "response.completed":
+                    completed = True
+                elif event.type in ("response.failed", "response.incomplete", "error"):
+                    yield _sse(f"⚠️ AI could not process your question: {_stream_error(event)}", event="error")
+                    return
+    except Exception as e:
+        yield _sse(f"⚠️ AI could not process your question: {e}", event="error")
+        return
+
+    reply = "".join(parts)
+    if not completed or not reply:
+        detail = "the response was empty" if completed else "the response ended early"
+        yield _sse(f"⚠️ AI could not process your question: {detail}", event="error")
+        return
+
+    if vector is not None:
+        _cache_reply(vector, reply)
+    await _store(_chat_exact, "chat", prompt_hash, reply)
+
 @app.post("/chat")
 async def chat(request: Request):
-    """AI chat about Dubai Building Code and compliance."""
+    """AI chat about Dubai Building Code and compliance.
+
+    Send {"stream": true} to receive the reply as server-sent events of text deltas.
+    """
     data = await request.json()
     message = data.get("message", "")
-    dbc_ref = (
-        "https://dm.gov.ae/wp-content/uploads/2021/12/"
-        "Dubai%20Building%20Code_English_2021%20Edition_compressed.pdf"
-    )
+    stream = bool(data.get("stream"))
 
     prompt = f"""
-    You are an AI Building Compliance Engineer using the Dubai Building Code 2021 ({dbc_ref}).
+    You are an AI Building Compliance Engineer using the Dubai Building Code 2021 ({DBC_URL}).
     Answer clearly and professionally, citing code sections when possible.
     Question: {message}
     """
 
+    prompt_hash = _sha256(prompt.encode())
     try:
-        response = client.responses.create(model="gpt-5", input=prompt)
-        return {"reply": response.output[0].content[0].text}
+        reply = await _lookup(_chat_exact, "chat", prompt_hash)
+        if reply is None:
+            try:
+                vector = await _embed(message)
+                reply = _cached_reply(vector)
+            except Exception:
+                # The semantic cache is optional: an embeddings error is a miss
+                vector = None
+            if reply is None:
+                response = await _get_client().responses.create(model="gpt-5", input=prompt, stream=stream)
+                if stream:
+                    return StreamingResponse(_stream_reply(response, prompt_hash, vector), media_type="text/event-stream")
+                reply = _response_text(response)
+                if vector is not None:
+                    _cache_reply(vector, reply)
+            await _store(_chat_exact, "chat", prompt_hash, reply)
     except Exception as e:
-        return {"reply": f"⚠️ AI could not process your question: {e}"}
+        reply = f"⚠️ AI could not process your question: {e}"
+        if stream:
+            return StreamingResponse(iter([_sse(reply, event="error")]), media_type="text/event-stream")
+
+    if stream:
+        return StreamingResponse(iter([_sse(reply)]), media_type="text/event-stream")
+    return {"reply": reply}
 
 # ---------------- /test ----------------
 @app.get("/test")